@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
+import atexit
+import glob
+import json
 import os
 import pickle
+import queue
+import re
+import sqlite3
+import threading
+import time
 import traceback
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import date
 
 import numpy as np
 import openai
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS, cross_origin
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 from fuzzywuzzy import fuzz
 
@@ -411,11 +422,11 @@ STATIC_QAS = {
         PAGE_LINKS["results and destinations"],
         URL_LABELS[PAGE_LINKS["results and destinations"]]
     ),
-    "what subjects do you offer"] = (
-    "We offer a broad curriculum across Art, Computing, Drama, English, Food Technology, French, Geography, History, Learning Support, Mathematics, Music, Philosophy, PSHEE, Religious Studies, Science, Sport & PE,Verbal & Non-Verbal Reasoning and more.",
-    PAGE_LINKS["curriculum"],
-    URL_LABELS[PAGE_LINKS["curriculum"]]
-)
+    "what subjects do you offer": (
+        "We offer a broad curriculum across Art, Computing, Drama, English, Food Technology, French, Geography, History, Learning Support, Mathematics, Music, Philosophy, PSHEE, Religious Studies, Science, Sport & PE,Verbal & Non-Verbal Reasoning and more.",
+        PAGE_LINKS["curriculum"],
+        URL_LABELS[PAGE_LINKS["curriculum"]]
+    ),
 }
 
 # ─── Load embeddings & metadata ───────────────────────────────────────────────
@@ -427,6 +438,898 @@ with open("metadata.pkl", "rb") as f:
 EMB_MODEL  = "text-embedding-3-small"
 CHAT_MODEL = "gpt-3.5-turbo"
 
+# ─── Upstream deadlines & circuit breakers ───────────────────────────────────
+# all budgets are in seconds; override any of them in .env
+EMB_TIMEOUT      = float(os.getenv("EMB_TIMEOUT", "3"))
+CHAT_TIMEOUT     = float(os.getenv("CHAT_TIMEOUT", "10"))
+ANSWER_BUDGET    = float(os.getenv("ANSWER_BUDGET", "12"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+# below this TF-IDF cosine the degraded path says "I don't know" rather than quote noise
+LEXICAL_MIN_SIM  = float(os.getenv("LEXICAL_MIN_SIM", "0.1"))
+# the same floor for embedding cosine, when chat is down but the query was embedded
+EXTRACTIVE_MIN_SIM = float(os.getenv("EXTRACTIVE_MIN_SIM", "0.25"))
+
+# start the query embedding while the static checks run (1/0)
+SPECULATE_EMBEDDING = os.getenv("SPECULATE_EMBEDDING", "1") == "1"
+# fire a second chat request if the first is slower than HEDGE_DELAY
+# (0 = use the observed p95 once HEDGE_MIN_SAMPLES calls have been seen)
+HEDGE_CHAT        = os.getenv("HEDGE_CHAT", "0") == "1"
+HEDGE_DELAY       = float(os.getenv("HEDGE_DELAY", "0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# hedges are paid for from a bucket earning HEDGE_BUDGET per chat call (≈5%)
+HEDGE_BUDGET      = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_BURST       = float(os.getenv("HEDGE_BURST", "3"))
+
+# admission control applies to RAG only; static answers are never shed.
+# all of it is per process: under gunicorn each worker enforces its own limits,
+# so the effective totals are these values × the number of workers
+# per-client token bucket: RATE_LIMIT_RPS refill, RATE_LIMIT_BURST capacity
+RATE_LIMIT_RPS   = float(os.getenv("RATE_LIMIT_RPS", "0.5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", "10000"))
+# RAG_CONCURRENCY requests run at once, up to RAG_QUEUE_DEPTH more wait
+# at most RAG_QUEUE_WAIT seconds for a slot
+RAG_CONCURRENCY  = int(os.getenv("RAG_CONCURRENCY", "8"))
+RAG_QUEUE_DEPTH  = int(os.getenv("RAG_QUEUE_DEPTH", "16"))
+RAG_QUEUE_WAIT   = float(os.getenv("RAG_QUEUE_WAIT", "2"))
+# proxies in front of us that append to X-Forwarded-For (Render: 1); clients
+# are keyed on the hop the outermost trusted proxy saw. 0 = no proxy
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# conversation sessions: recent turns up to HISTORY_TOKENS go into the prompt,
+# older ones are compacted into a summary of at most SUMMARY_TOKENS
+SESSION_MAX       = int(os.getenv("SESSION_MAX", "2000"))
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", str(8 * 1024 * 1024)))
+# sqlite path; empty = memory only, which is per process, so set it for more than one worker
+SESSION_DB        = os.getenv("SESSION_DB", "")
+# turns are merged into sqlite by a writer thread every SESSION_DB_FLUSH seconds (other
+# workers see them from then on); rows idle past SESSION_DB_TTL, or beyond the newest
+# SESSION_DB_MAX_ROWS, are pruned
+SESSION_DB_FLUSH    = float(os.getenv("SESSION_DB_FLUSH", "1"))
+SESSION_DB_BUFFER   = int(os.getenv("SESSION_DB_BUFFER", "5000"))
+SESSION_DB_TTL      = float(os.getenv("SESSION_DB_TTL", str(7 * 24 * 3600)))
+SESSION_DB_MAX_ROWS = int(os.getenv("SESSION_DB_MAX_ROWS", "50000"))
+HISTORY_TOKENS    = int(os.getenv("HISTORY_TOKENS", "500"))
+SUMMARY_TOKENS    = int(os.getenv("SUMMARY_TOKENS", "150"))
+TURN_CHARS        = int(os.getenv("TURN_CHARS", "600"))
+
+# query/answer log: a writer thread batches entries to rotating JSONL files
+QUERY_LOG_DIR       = os.getenv("QUERY_LOG_DIR", "query_logs")   # empty = off
+QUERY_LOG_BUFFER    = int(os.getenv("QUERY_LOG_BUFFER", "10000"))
+QUERY_LOG_BATCH     = int(os.getenv("QUERY_LOG_BATCH", "500"))
+QUERY_LOG_FLUSH     = float(os.getenv("QUERY_LOG_FLUSH", "2"))
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+QUERY_LOG_BACKUPS   = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+# each worker process writes its own queries-<pid>.jsonl. Beyond QUERY_LOG_MAX_FILES,
+# files of exited workers, or idle past QUERY_LOG_IDLE seconds, are pruned oldest first
+QUERY_LOG_MAX_FILES = int(os.getenv("QUERY_LOG_MAX_FILES", "50"))
+QUERY_LOG_IDLE      = float(os.getenv("QUERY_LOG_IDLE", str(24 * 3600)))
+
+# answers to first-turn RAG questions, warmed at startup from WARM_CACHE_PATH
+# (built offline by `python query_insights.py warm`)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL  = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+WARM_CACHE_PATH   = os.getenv("WARM_CACHE_PATH", "warm_cache.json")
+
+# the SDK's built-in retries would stretch a slow upstream past our deadlines
+openai.max_retries = 0
+
+# OpenAI calls run here so /ask can stop waiting the moment a deadline passes
+upstream_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPSTREAM_WORKERS", "16")),
+    thread_name_prefix="upstream",
+)
+
+metrics      = Counter()
+metrics_lock = threading.Lock()
+
+def count(name, n=1):
+    with metrics_lock:
+        metrics[name] += n
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """closed → open after N consecutive failures; one probe after the cooldown"""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name      = name
+        self.failures  = failures
+        self.cooldown  = cooldown
+        self.state     = "closed"
+        self.streak    = 0
+        self.opened_at = 0.0
+        self.trips     = 0
+        self.lock      = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            # a probe that never reports back doesn't wedge us in half_open
+            if self.state != "closed" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state, self.opened_at = "half_open", time.monotonic()
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self.lock:
+            self.state, self.streak = "closed", 0
+
+    def record_failure(self):
+        with self.lock:
+            self.streak += 1
+            if self.state == "half_open" or self.streak >= self.failures:
+                if self.state != "open":
+                    self.trips += 1
+                self.state, self.opened_at = "open", time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.streak, "trips": self.trips}
+
+
+emb_breaker  = CircuitBreaker("embeddings")
+chat_breaker = CircuitBreaker("chat")
+
+def remaining(deadline):
+    return deadline - time.monotonic()
+
+def submit_upstream(breaker, timeout, fn, **kwargs):
+    # a spent budget is not the upstream's fault, so it doesn't count as a failure
+    if timeout <= 0:
+        raise UpstreamUnavailable(f"{breaker.name}: deadline passed")
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"{breaker.name}: circuit open")
+    return upstream_pool.submit(fn, timeout=timeout, **kwargs)
+
+def await_upstream(breaker, future, deadline):
+    try:
+        result = future.result(timeout=max(0, remaining(deadline)))
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        if future.cancel() or future.cancelled():
+            # never left our own pool — local contention says nothing about OpenAI
+            count(f"{breaker.name}.not_started")
+            raise UpstreamUnavailable(f"{breaker.name}: no free upstream worker") from e
+        breaker.record_failure()
+        raise UpstreamUnavailable(f"{breaker.name}: {e!r}") from e
+    breaker.record_success()
+    return result
+
+def failed_future(exc):
+    future = Future()
+    future.set_exception(exc)
+    return future
+
+# ─── Admission control ────────────────────────────────────────────────────────
+class RateLimiter:
+    """token bucket per client, LRU-bounded so a flood of ids can't grow it forever"""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_CLIENTS):
+        self.rate        = rate
+        self.burst       = burst
+        self.max_clients = max_clients
+        self.buckets     = OrderedDict()   # client → (tokens, last refill)
+        self.lock        = threading.Lock()
+
+    def _refill(self, client, now):
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def would_allow(self, client):
+        with self.lock:
+            return self._refill(client, time.monotonic()) >= 1
+
+    def take(self, client):
+        """returns 0 when admitted, otherwise seconds until a token is due"""
+        now = time.monotonic()
+        with self.lock:
+            tokens = self._refill(client, now)
+            admitted = tokens >= 1
+            if admitted:
+                tokens -= 1
+            self.buckets[client] = (tokens, now)
+            self.buckets.move_to_end(client)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return 0 if admitted else (1 - tokens) / self.rate
+
+
+class RagGate:
+    """bounded admission queue in front of the slow RAG path"""
+
+    def __init__(self, slots=RAG_CONCURRENCY, depth=RAG_QUEUE_DEPTH, max_wait=RAG_QUEUE_WAIT):
+        self.slots    = slots
+        self.depth    = depth
+        self.max_wait = max_wait
+        self.active   = 0
+        self.waiting  = 0
+        self.cond     = threading.Condition()
+
+    def saturated(self):
+        with self.cond:
+            return self.active >= self.slots and self.waiting >= self.depth
+
+    def acquire(self):
+        """returns None once a slot is held, otherwise the reason it was shed"""
+        with self.cond:
+            if self.active < self.slots:
+                self.active += 1
+                return None
+            if self.waiting >= self.depth:
+                return "queue_full"
+            self.waiting += 1
+            try:
+                if not self.cond.wait_for(lambda: self.active < self.slots, timeout=self.max_wait):
+                    return "queue_timeout"
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def snapshot(self):
+        with self.cond:
+            return {"active": self.active, "waiting": self.waiting,
+                    "slots": self.slots, "max_depth": self.depth}
+
+
+rate_limiter = RateLimiter()
+rag_gate     = RagGate()
+
+def client_id():
+    # ProxyFix has already resolved this to the address our trusted proxy saw;
+    # the leftmost X-Forwarded-For hops are client-controlled and never used
+    return request.remote_addr
+
+def shed_response(status, retry_after, reason):
+    count(f"shed.{reason}")
+    g.branch = f"shed.{reason}"
+    resp = jsonify(
+        error="We're very busy right now — please try again in a moment.",
+        reason=reason
+    )
+    resp.headers["Retry-After"] = str(max(1, int(np.ceil(retry_after))))
+    return resp, status
+
+# ─── Query vectors: cached embeddings + lexical fallback ──────────────────────
+query_vectors    = OrderedDict()
+query_cache_lock = threading.Lock()
+
+def cached_query_vector(key):
+    with query_cache_lock:
+        vec = query_vectors.get(key)
+        if vec is not None:
+            query_vectors.move_to_end(key)
+        return vec
+
+def store_query_vector(key, vec):
+    with query_cache_lock:
+        query_vectors[key] = vec
+        query_vectors.move_to_end(key)
+        while len(query_vectors) > QUERY_CACHE_SIZE:
+            query_vectors.popitem(last=False)
+
+def fetch_query_vector(key, question, timeout):
+    emb = openai.embeddings.create(model=EMB_MODEL, input=question, timeout=timeout)
+    vec = np.array(emb.data[0].embedding, dtype="float32")
+    store_query_vector(key, vec)
+    return vec
+
+def start_embedding(key, question, deadline):
+    """returns (future, stage deadline); the future resolves to the query vector"""
+    vec = cached_query_vector(key)
+    if vec is not None:
+        count("query_vector.cache_hit")
+        future = Future()
+        future.set_result(vec)
+        return future, deadline
+    timeout = min(EMB_TIMEOUT, remaining(deadline))
+    try:
+        future = submit_upstream(emb_breaker, timeout, fetch_query_vector, key=key, question=question)
+    except UpstreamUnavailable as e:
+        return failed_future(e), deadline
+    future.started = time.monotonic()
+    future.add_done_callback(lambda f: setattr(f, "finished", time.monotonic()))
+    return future, future.started + timeout
+
+def finish_embedding(future, stage_deadline):
+    # cache hits and refused calls never reached upstream; keep the breaker out of it
+    if not hasattr(future, "started"):
+        return future.result()
+    needed_at = time.monotonic()
+    vec = await_upstream(emb_breaker, future, stage_deadline)
+    finished = getattr(future, "finished", time.monotonic())
+    # microseconds: the fuzzy pass it overlaps is usually well under a millisecond
+    count("speculative.embedding_us_saved", int(1e6 * (min(finished, needed_at) - future.started)))
+    return vec
+
+def abandon_embedding(future):
+    # an in-flight call can't be recalled; its vector still lands in the cache
+    if not future.done() and not future.cancel():
+        count("speculative.embeddings_wasted")
+
+# ─── Chat: optional hedged request ────────────────────────────────────────────
+chat_latencies = deque(maxlen=200)
+chat_lat_lock  = threading.Lock()
+hedge_tokens   = HEDGE_BURST
+hedge_lock     = threading.Lock()
+
+def record_chat_latency(future):
+    # primaries only, and failures count as a full timeout, so a slowdown
+    # pushes p95 up instead of being hidden by fast hedges
+    if future.cancelled():
+        return
+    latency = future.result()[1] if future.exception() is None else CHAT_TIMEOUT
+    with chat_lat_lock:
+        chat_latencies.append(latency)
+
+def earn_hedge_token():
+    global hedge_tokens
+    with hedge_lock:
+        hedge_tokens = min(HEDGE_BURST, hedge_tokens + HEDGE_BUDGET)
+
+def take_hedge_token():
+    global hedge_tokens
+    with hedge_lock:
+        if hedge_tokens < 1:
+            return False
+        hedge_tokens -= 1
+        return True
+
+def hedge_delay():
+    if HEDGE_DELAY > 0:
+        return HEDGE_DELAY
+    with chat_lat_lock:
+        if len(chat_latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(chat_latencies, 95))
+
+def timed_chat(timeout, **kwargs):
+    started = time.monotonic()
+    chat = openai.chat.completions.create(timeout=timeout, **kwargs)
+    return chat, time.monotonic() - started
+
+def chat_completion(deadline, **kwargs):
+    timeout = min(CHAT_TIMEOUT, remaining(deadline))
+    stage_deadline = time.monotonic() + timeout
+    primary = submit_upstream(chat_breaker, timeout, timed_chat, **kwargs)
+    primary.add_done_callback(record_chat_latency)
+    earn_hedge_token()
+    delay = hedge_delay() if HEDGE_CHAT else None
+
+    pending = {primary}
+    if delay is not None and delay < timeout and not wait(pending, timeout=delay).done:
+        # never pile extra calls onto an upstream that is already failing
+        if chat_breaker.state != "closed":
+            count("hedge.skipped_breaker")
+        elif not take_hedge_token():
+            count("hedge.skipped_budget")
+        else:
+            try:
+                backup = submit_upstream(chat_breaker, remaining(stage_deadline), timed_chat, **kwargs)
+                count("hedge.fired")
+                pending.add(backup)
+            except UpstreamUnavailable:
+                pass
+
+    winner = None
+    while pending and winner is None and remaining(stage_deadline) > 0:
+        done, pending = wait(pending, timeout=remaining(stage_deadline), return_when=FIRST_COMPLETED)
+        winner = next((f for f in done if f.exception() is None), None)
+    for f in pending:
+        f.cancel()
+    if winner is None:
+        return await_upstream(chat_breaker, primary, stage_deadline)[0]
+
+    chat_breaker.record_success()
+    chat, _ = winner.result()
+    if winner is not primary:
+        count("hedge.won")
+        # the saving is however much longer the primary keeps us waiting
+        won_at = time.monotonic()
+        primary.add_done_callback(
+            lambda f: count("hedge.ms_saved", int(1000 * (time.monotonic() - won_at)))
+        )
+    return chat
+
+# ─── Lexical index ────────────────────────────────────────────────────────────
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+# function words carry no topic; left in, they make every question look similar
+STOPWORDS = set("""
+a about am an and any are as at be can could do does for from had has have how i
+if in is it its me my of on or our please tell that the their them there these they
+this to today us was we what when where which who will with would you your
+""".split())
+
+def content_tokens(text):
+    return [tok for tok in tokenize(text) if tok not in STOPWORDS]
+
+# TF-IDF over the same chunks, so retrieval still works without the embeddings API
+lexical_vocab = {}
+for item in metadata:
+    for tok in set(content_tokens(item["text"])):
+        lexical_vocab.setdefault(tok, len(lexical_vocab))
+lexical_matrix = np.zeros((len(metadata), len(lexical_vocab)), dtype="float32")
+for row, item in enumerate(metadata):
+    for tok in content_tokens(item["text"]):
+        lexical_matrix[row, lexical_vocab[tok]] += 1
+lexical_idf     = np.log((1 + len(metadata)) / (1 + (lexical_matrix > 0).sum(axis=0))) + 1
+lexical_matrix *= lexical_idf
+lexical_matrix /= np.linalg.norm(lexical_matrix, axis=1, keepdims=True) + 1e-8
+
+def lexical_sims(question):
+    q_vec = np.zeros(len(lexical_vocab), dtype="float32")
+    for tok in content_tokens(question):
+        if tok in lexical_vocab:
+            q_vec[lexical_vocab[tok]] += 1
+    q_vec *= lexical_idf
+    return lexical_matrix @ (q_vec / (np.linalg.norm(q_vec) + 1e-8))
+
+def lexical_top(question, k=20):
+    """top-k chunk indices, or an empty array when nothing is similar enough"""
+    sims = lexical_sims(question)
+    top = sims.argsort()[-k:][::-1]
+    return top[sims[top] >= LEXICAL_MIN_SIM]
+
+def lexical_score(question, k=3):
+    return float(np.sort(lexical_sims(question))[-k:].mean())
+
+# ─── Conversation sessions ────────────────────────────────────────────────────
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+FOLLOW_UP_RE  = re.compile(r"^(and|also|or|but|what about|how about|what if|same for)\b")
+PRONOUNS      = {"it", "its", "they", "them", "their", "those", "these", "he", "him", "she", "his", "her"}
+
+def approx_tokens(text):
+    # ~4 chars per token is close enough for budgeting and avoids a tokenizer in the hot path
+    return len(text) // 4 + 1
+
+def depends_on_history(question):
+    # a leading connective ("and for Year 3?"), or a pronoun with almost
+    # nothing else to search on ("how much does it cost?")
+    lowered = question.lower()
+    if FOLLOW_UP_RE.search(lowered):
+        return True
+    return bool(PRONOUNS & set(tokenize(lowered))) and len(content_tokens(lowered)) <= 2
+
+def standalone_query(question, turns):
+    """returns (retrieval query, topic); follow-ups are folded onto the previous topic"""
+    if not turns or not depends_on_history(question):
+        return question, question
+    # the topic is always an unfolded question, so chained follow-ups never snowball
+    topic  = turns[-1].get("topic", turns[-1]["question"])
+    folded = f"{topic} {question}"
+    # only keep the fold if it actually retrieves better than the bare question
+    if lexical_score(folded) < lexical_score(question):
+        count("sessions.fold_rejected")
+        return question, question
+    count("sessions.folded")
+    return folded, topic
+
+
+def compact_session(session):
+    # oldest turns leave the window and survive only as a topic in the summary
+    while len(session["turns"]) > 1 and sum(
+        approx_tokens(t["question"]) + approx_tokens(t["answer"]) for t in session["turns"]
+    ) > HISTORY_TOKENS:
+        oldest = session["turns"].pop(0)
+        session["summary"] = "; ".join(filter(None, [session["summary"], oldest["question"]]))
+    limit = SUMMARY_TOKENS * 4
+    if len(session["summary"]) > limit:
+        session["summary"] = "…" + session["summary"][-limit:]
+    return session
+
+
+class SessionStore:
+    """LRU of conversations, capped by count and total characters, optionally backed by sqlite.
+
+    With a db the sqlite row is the source of truth for every worker: turns are queued
+    as appends and merged into the row by a writer thread, and the LRU only caches rows
+    by version. Without one, history lives in this process alone.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, max_chars=SESSION_MAX_CHARS, db_path=SESSION_DB):
+        self.max_sessions = max_sessions
+        self.max_chars    = max_chars
+        self.sessions     = OrderedDict()   # id → {"summary": str, "turns": [...], "chars": int}
+        self.chars        = 0
+        self.evictions    = 0
+        self.lock         = threading.Lock()
+        self.db_path      = db_path
+        self.db_rows      = 0
+        self.pid          = None
+        self.start_lock   = threading.Lock()
+        if not db_path:
+            if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+                print("⚠️ SESSION_DB is not set: each worker keeps its own conversation history")
+            return
+        db = sqlite3.connect(db_path)
+        db.execute("PRAGMA journal_mode=WAL")   # reads don't wait for the writer
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(id TEXT PRIMARY KEY, data TEXT, updated REAL, version INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "version" not in {row[1] for row in db.execute("PRAGMA table_info(sessions)")}:
+            db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        db.commit()
+        db.close()
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        # like QueryLog: the writer thread and connections belong to the process using
+        # them, since neither survives `gunicorn --preload` forking
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # turns wait here, per session, until the writer merges them into sqlite
+            self.pending      = {}   # id → {"turns": [...], "updated": ts}
+            self.pending_lock = threading.Lock()
+            # held for a row read and for a batch commit, so a read sees each turn exactly once
+            self.flush_lock   = threading.Lock()
+            self.reader       = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.stopping     = threading.Event()
+            self.writer       = threading.Thread(target=self._run_writer, name="session-db", daemon=True)
+            self.writer.start()
+            self.pid          = os.getpid()
+
+    def _put(self, sid, session):
+        old = self.sessions.pop(sid, None)
+        if old is not None:
+            self.chars -= old["chars"]
+        session["chars"] = len(session["summary"]) + sum(
+            len(t["question"]) + len(t["answer"]) + len(t["query"]) + len(t.get("topic", ""))
+            for t in session["turns"]
+        )
+        self.sessions[sid] = session
+        self.chars += session["chars"]
+        while len(self.sessions) > 1 and (
+            len(self.sessions) > self.max_sessions or self.chars > self.max_chars
+        ):
+            _, evicted = self.sessions.popitem(last=False)
+            self.chars -= evicted["chars"]
+            self.evictions += 1
+
+    def _load(self, sid):
+        with self.lock:
+            session = self.sessions.get(sid)
+            if session is not None:
+                self.sessions.move_to_end(sid)
+            return session
+
+    def _read_db(self, sid):
+        # the row only comes back if it changed since we cached it
+        self._ensure_started()
+        with self.lock:
+            cached = self.sessions.get(sid)
+        with self.flush_lock:
+            with self.pending_lock:
+                local = list(self.pending.get(sid, {}).get("turns", []))
+            row = self.reader.execute(
+                "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END "
+                "FROM sessions WHERE id = ? AND updated >= ?",
+                (cached["version"] if cached else -1, sid, time.time() - SESSION_DB_TTL),
+            ).fetchone()
+        if row is None:
+            session = None
+        elif row[1] is None:
+            session = cached
+        else:
+            session = dict(json.loads(row[1]), version=row[0])
+            with self.lock:
+                self._put(sid, session)
+        if not local:
+            return session
+        # turns this process hasn't flushed yet
+        return compact_session({"summary": session["summary"] if session else "",
+                                "turns": (session["turns"] if session else []) + local})
+
+    def history(self, sid):
+        """returns (summary, recent turns) — both empty for a new session"""
+        session = self._read_db(sid) if self.db_path else self._load(sid)
+        if session is None:
+            return "", []
+        with self.lock:
+            return session["summary"], list(session["turns"])
+
+    def record_turn(self, sid, question, answer, query, topic):
+        turn = {"question": question[:TURN_CHARS], "answer": answer[:TURN_CHARS],
+                "query": query[:TURN_CHARS], "topic": topic[:TURN_CHARS]}
+        if self.db_path:
+            self._ensure_started()
+            with self.pending_lock:
+                entry = self.pending.get(sid)
+                if entry is None:
+                    if len(self.pending) >= SESSION_DB_BUFFER:
+                        count("sessions.db_dropped")
+                        return
+                    entry = self.pending[sid] = {"turns": []}
+                entry["turns"].append(turn)
+                entry["updated"] = time.time()
+            return
+        session = self._load(sid)
+        with self.lock:
+            session = session or {"summary": "", "turns": []}
+            session["turns"].append(turn)
+            self._put(sid, compact_session(session))
+
+    # ── sqlite writer thread ──
+    def _run_writer(self):
+        db = sqlite3.connect(self.db_path, isolation_level=None)
+        last_prune = 0.0
+        while not self.stopping.wait(SESSION_DB_FLUSH):
+            self._flush(db)
+            if time.monotonic() - last_prune >= 60:
+                self._prune(db)
+                last_prune = time.monotonic()
+        self._flush(db)
+        db.close()
+
+    def _flush(self, db):
+        with self.flush_lock:
+            with self.pending_lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return
+            try:
+                # IMMEDIATE takes the write lock up front, so another worker can't
+                # write the row between our read and our write
+                db.execute("BEGIN IMMEDIATE")
+                for sid, entry in batch.items():
+                    row = db.execute(
+                        "SELECT data, updated, version FROM sessions WHERE id = ?", (sid,)
+                    ).fetchone()
+                    session = {"summary": "", "turns": []}
+                    if row and row[1] >= time.time() - SESSION_DB_TTL:
+                        session = json.loads(row[0])
+                    session["turns"].extend(entry["turns"])
+                    compact_session(session)
+                    # time-based so a pruned and re-created row never reuses a cached version
+                    version = max((row[2] if row else 0) + 1, time.time_ns() // 1000)
+                    db.execute(
+                        "INSERT OR REPLACE INTO sessions (id, data, updated, version) VALUES (?, ?, ?, ?)",
+                        (sid, json.dumps(session), entry["updated"], version),
+                    )
+                db.execute("COMMIT")
+                count("sessions.db_written", len(batch))
+            except sqlite3.Error:
+                traceback.print_exc()
+                count("sessions.db_errors")
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+
+    def _prune(self, db):
+        try:
+            db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - SESSION_DB_TTL,))
+            db.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (SESSION_DB_MAX_ROWS,),
+            )
+            self.db_rows = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        except sqlite3.Error:
+            traceback.print_exc()
+            count("sessions.db_errors")
+
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.writer.join(timeout=5)
+
+    def snapshot(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), "chars": self.chars,
+                    "max_sessions": self.max_sessions, "max_chars": self.max_chars,
+                    "evictions": self.evictions, "persistent": bool(self.db_path),
+                    "db_rows": self.db_rows}
+
+
+session_store = SessionStore()
+
+def history_messages(summary, turns):
+    messages = []
+    if summary:
+        messages.append({"role": "system",
+                         "content": f"Earlier in this conversation the visitor asked about: {summary}"})
+    for t in turns:
+        messages.append({"role": "user",      "content": t["question"]})
+        messages.append({"role": "assistant", "content": t["answer"]})
+    return messages
+
+# ─── Answer cache & cache warming ─────────────────────────────────────────────
+answer_cache      = OrderedDict()   # key → (expires at, answer, url, link_label)
+answer_cache_lock = threading.Lock()
+
+def cached_answer(key):
+    with answer_cache_lock:
+        entry = answer_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del answer_cache[key]
+            return None
+        answer_cache.move_to_end(key)
+        return entry[1:]
+
+def store_answer(key, answer, url, link_label, ttl=ANSWER_CACHE_TTL):
+    with answer_cache_lock:
+        answer_cache[key] = (time.monotonic() + ttl, answer, url, link_label)
+        answer_cache.move_to_end(key)
+        while len(answer_cache) > ANSWER_CACHE_SIZE:
+            answer_cache.popitem(last=False)
+
+def load_warm_cache(path=WARM_CACHE_PATH):
+    # the cache only saves latency, so a missing or bad file must never stop the app booting
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        if not isinstance(entries, list):
+            raise ValueError("expected a list of entries")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring warm cache {path}: {e}")
+        return
+    warmed = skipped = 0
+    for e in entries:
+        try:
+            # query vectors don't go stale; answers were written against that day's prompt
+            store_query_vector(e["key"], np.array(e["vector"], dtype="float32"))
+            ttl = ANSWER_CACHE_TTL - (time.time() - e.get("generated_at", 0))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            skipped += 1
+            continue
+        if e.get("answer") and ttl > 0:
+            store_answer(e["key"], e["answer"], e.get("url"), e.get("link_label"), ttl=ttl)
+            warmed += 1
+    print(f"🔥 Warmed {warmed}/{len(entries)} cached answers from {path} "
+          f"({len(entries) - warmed - skipped} too old, {skipped} malformed)")
+
+load_warm_cache()
+
+# ─── Query log ────────────────────────────────────────────────────────────────
+class QueryLog:
+    """the request path only enqueues; a writer thread appends batches to disk"""
+
+    def __init__(self, directory=QUERY_LOG_DIR, buffer=QUERY_LOG_BUFFER, batch=QUERY_LOG_BATCH,
+                 flush_every=QUERY_LOG_FLUSH, max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS,
+                 max_files=QUERY_LOG_MAX_FILES, idle=QUERY_LOG_IDLE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory   = directory
+        self.buffer      = buffer
+        self.batch       = batch
+        self.flush_every = flush_every
+        self.max_bytes   = max_bytes
+        self.backups     = max(1, backups)
+        self.max_files   = max_files
+        self.idle        = idle
+        self.pid         = None
+        self.start_lock  = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        # started lazily in the process that logs: with `gunicorn --preload` the
+        # app is imported before forking, and neither threads nor the pid survive that
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.path     = os.path.join(self.directory, f"queries-{os.getpid()}.jsonl")
+            self.queue    = queue.Queue(maxsize=self.buffer)
+            self.stopping = threading.Event()
+            self.thread   = threading.Thread(target=self._run, name="query-log", daemon=True)
+            self.thread.start()
+            self.pid      = os.getpid()
+
+    def log(self, **entry):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            count("query_log.dropped")
+
+    def _run(self):
+        # restarted workers leave small files that never rotate, so prune on start too
+        self._prune_files()
+        while not self.stopping.wait(self.flush_every):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if len(batch) < self.batch:
+                return
+
+    def _write(self, batch):
+        try:
+            self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+            count("query_log.written", len(batch))
+        except OSError:
+            traceback.print_exc()
+            count("query_log.write_errors")
+
+    def _rotate(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._prune_files()
+
+    def _prune_files(self):
+        # counting our live file even before its first write
+        paths = set(glob.glob(os.path.join(self.directory, "queries*.jsonl*"))) | {self.path}
+        if len(paths) <= self.max_files:
+            return
+        candidates = []
+        for path in paths:
+            if path.startswith(self.path):   # never our own live file or backups
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if not self._owner_alive(path) or time.time() - mtime > self.idle:
+                candidates.append((mtime, path))
+        for _, path in sorted(candidates)[:len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass   # another worker got there first
+
+    @staticmethod
+    def _owner_alive(path):
+        match = re.match(r"queries-(\d+)\.jsonl", os.path.basename(path))
+        if not match:
+            return False
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass   # exists, owned by another user
+        return True
+
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.thread.join(timeout=5)
+
+    def snapshot(self):
+        if self.pid != os.getpid():
+            return {"path": None, "buffered": 0, "capacity": self.buffer}
+        return {"path": self.path, "buffered": self.queue.qsize(), "capacity": self.queue.maxsize}
+
+
+query_log = QueryLog() if QUERY_LOG_DIR else None
+
 # ─── System prompt ────────────────────────────────────────────────────────────
 today = date.today().isoformat()
 system_prompt = (
@@ -439,6 +1342,8 @@ system_prompt = (
 
 # ─── Create Flask app & enable CORS (serve static/chat.html) ─────────────────
 app = Flask(__name__, static_folder="static")
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 CORS(app, resources={r"/ask": {"origins": "*"}})
 
 from flask import redirect
@@ -480,93 +1385,232 @@ def format_response(ans):
     paras.append(footer)
     return "\n\n".join(paras)
 
-# ─── /ask endpoint ────────────────────────────────────────────────────────────
-@app.route("/ask", methods=["POST"])
-@cross_origin()
-def ask():
-    try:
-        data     = request.get_json(force=True)
-        question = data.get("question","").strip()
-        if not question:
-            return jsonify(error="No question provided"), 400
+def keyword_url(key):
+    # only match full keys longer than 6 chars
+    for k, u in PAGE_LINKS.items():
+        if len(k) > 6 and k in key:
+            return u
+    return None
 
-        key = question.lower().rstrip("?")
+def strip_boilerplate(ans):
+    # the greeting and footer are on every answer; keep them out of session history
+    return ans.replace("Anything else I can help you with today?", "") \
+              .replace("Thank you for your question!", "").strip()
 
-        # 1) Exact static
-        if key in STATIC_QAS:
-            raw,url,label = STATIC_QAS[key]
-            return jsonify(
-                answer=format_response(remove_bullets(raw)),
-                url=url,
-                link_label=label
-            ), 200
+def extractive_answer(top, n=3, max_chars=400):
+    # degraded mode: quote the best passages verbatim instead of asking the LLM.
+    # Not run through format_response, which would re-split them and add "." after "…"
+    passages = []
+    for i in top[:n]:
+        text = " ".join(metadata[i]["text"].split())
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(" ", 1)[0] + "…"
+        passages.append(text)
+    return "\n\n".join([
+        "Thank you for your question!",
+        "Here is what our website says about that:",
+        *passages,
+        "Anything else I can help you with today?",
+    ])
 
-        # 2) Fuzzy static
-        for sk,(raw,url,label) in STATIC_QAS.items():
-            if fuzz.partial_ratio(sk, key) > 80:
-                return jsonify(
-                    answer=format_response(remove_bullets(raw)),
-                    url=url,
-                    link_label=label
-                ), 200
-
-        # 3) Welcome trigger
-        if question == "__welcome__":
-            raw = (
-                "Hi there! Ask me anything about Ripley Court School.\n\n"
-                "We tailor our prospectus to your enquiry. For more details, visit below.\n\n"
-                "Anything else I can help you with today?"
-            )
-            return jsonify(
-                answer=remove_bullets(raw),
-                url=PAGE_LINKS["enquire"],
-                link_label=URL_LABELS[PAGE_LINKS["enquire"]]
-            ), 200
+def extractive_response(top):
+    """top: chunk indices already filtered to those similar enough to quote"""
+    g.branch = "extractive"
+    if not len(top):
+        return jsonify(
+            answer=format_response("I'm sorry, I don't have that information."),
+            url=None,
+            degraded=True
+        ), 200
+    url = metadata[top[0]].get("url")
+    return jsonify(
+        answer=extractive_answer(top),
+        url=url,
+        link_label=URL_LABELS.get(url),
+        degraded=True
+    ), 200
 
-        # 4) Guard “how many…”
-        if key.startswith("how many"):
-            return jsonify(
-                answer=format_response("I'm sorry, I don't have that information."),
-                url=None
-            ), 200
+def rag_answer(question, query, summary, turns, relevant_url, emb_future, emb_deadline, deadline):
+    try:
+        q_vec = finish_embedding(emb_future, emb_deadline)
+    except UpstreamUnavailable as e:
+        print(f"⚠️ {e} — answering extractively")
+        count("fallback.embeddings")
+        return extractive_response(lexical_top(query))
 
-        # 5) Keyword → URL (only match full keys longer than 6 chars)
-        relevant_url = None
-        for k, u in PAGE_LINKS.items():
-           if len(k) > 6 and k in key:
-               relevant_url = u
-               break
-
-
-        # 6) RAG fallback
-        emb = openai.embeddings.create(model=EMB_MODEL, input=question)
-        q_vec = np.array(emb.data[0].embedding, dtype="float32")
-        sims = cosine_similarities(embeddings, q_vec)
-        top = sims.argsort()[-20:][::-1]
-        contexts = [metadata[i]["text"] for i in top]
-        prompt   = "Use these passages:\n\n" + "\n---\n".join(contexts)
-        prompt  += f"\n\nQuestion: {question}\nAnswer:"
-        chat     = openai.chat.completions.create(
+    sims = cosine_similarities(embeddings, q_vec)
+    top = sims.argsort()[-20:][::-1]
+    contexts = [metadata[i]["text"] for i in top]
+    prompt   = "Use these passages:\n\n" + "\n---\n".join(contexts)
+    prompt  += f"\n\nQuestion: {question}\nAnswer:"
+    try:
+        chat = chat_completion(
+            deadline,
             model=CHAT_MODEL,
             messages=[
                 {"role":"system","content":system_prompt},
+                *history_messages(summary, turns),
                 {"role":"user",  "content":prompt}
             ]
         )
-        raw     = chat.choices[0].message.content
-        answer  = format_response(remove_bullets(raw))
+    except UpstreamUnavailable as e:
+        print(f"⚠️ {e} — answering extractively")
+        count("fallback.chat")
+        return extractive_response(top[sims[top] >= EXTRACTIVE_MIN_SIM])
+    raw     = chat.choices[0].message.content
+    answer  = format_response(remove_bullets(raw))
+
+    # fallback URL + label
+    if not relevant_url and top.size:
+        relevant_url = metadata[top[0]].get("url")
+    link_label = URL_LABELS.get(relevant_url)
+
+    g.branch = "rag"
+    if not turns:
+        store_answer(question.lower().rstrip("?"), answer, relevant_url, link_label)
+    return jsonify(answer=answer, url=relevant_url, link_label=link_label), 200
+
+def route_question(question, key, query, summary, turns):
+    # 1) Exact static
+    if key in STATIC_QAS:
+        g.branch = "static"
+        raw,url,label = STATIC_QAS[key]
+        return jsonify(
+            answer=format_response(remove_bullets(raw)),
+            url=url,
+            link_label=label
+        ), 200
+
+    # 1b) Pre-computed RAG answer (first turn only — history changes the answer)
+    hit = None if turns else cached_answer(key)
+    if hit:
+        g.branch = "answer_cache"
+        answer, url, label = hit
+        return jsonify(answer=answer, url=url, link_label=label), 200
+
+    # every upstream stage below shares one answer budget; retrieval uses the
+    # standalone query so follow-ups like "and for Year 3?" keep their context
+    query_key = query.lower().rstrip("?")
+    deadline = time.monotonic() + ANSWER_BUDGET
+    cid = client_id()
+    speculate = (SPECULATE_EMBEDDING and question != "__welcome__"
+                 and not key.startswith("how many")
+                 and rate_limiter.would_allow(cid) and not rag_gate.saturated())
+    if speculate:
+        count("speculative.embeddings")
+        emb_future, emb_deadline = start_embedding(query_key, query, deadline)
+
+    # 2) Fuzzy static
+    for sk,(raw,url,label) in STATIC_QAS.items():
+        if fuzz.partial_ratio(sk, key) > 80:
+            if speculate:
+                abandon_embedding(emb_future)
+            g.branch = "fuzzy"
+            return jsonify(
+                answer=format_response(remove_bullets(raw)),
+                url=url,
+                link_label=label
+            ), 200
+
+    # 3) Welcome trigger
+    if question == "__welcome__":
+        g.branch = "welcome"
+        raw = (
+            "Hi there! Ask me anything about Ripley Court School.\n\n"
+            "We tailor our prospectus to your enquiry. For more details, visit below.\n\n"
+            "Anything else I can help you with today?"
+        )
+        return jsonify(
+            answer=remove_bullets(raw),
+            url=PAGE_LINKS["enquire"],
+            link_label=URL_LABELS[PAGE_LINKS["enquire"]]
+        ), 200
+
+    # 4) Guard “how many…”
+    if key.startswith("how many"):
+        g.branch = "how_many"
+        return jsonify(
+            answer=format_response("I'm sorry, I don't have that information."),
+            url=None
+        ), 200
+
+    # 5) Keyword → URL
+    relevant_url = keyword_url(key)
+
+    # 6) Admission: only the slow path is rate-limited and queued
+    retry_after = rate_limiter.take(cid)
+    if retry_after:
+        if speculate:
+            abandon_embedding(emb_future)
+        return shed_response(429, retry_after, "rate_limited")
+    shed = rag_gate.acquire()
+    if shed:
+        if speculate:
+            abandon_embedding(emb_future)
+        return shed_response(503, RAG_QUEUE_WAIT, shed)
+
+    # 7) RAG fallback
+    try:
+        if not speculate:
+            emb_future, emb_deadline = start_embedding(query_key, query, deadline)
+        return rag_answer(question, query, summary, turns, relevant_url,
+                          emb_future, emb_deadline, deadline)
+    finally:
+        rag_gate.release()
+
+# ─── /ask endpoint ────────────────────────────────────────────────────────────
+@app.route("/ask", methods=["POST"])
+@cross_origin(expose_headers=["Retry-After"])
+def ask():
+    started = time.monotonic()
+    try:
+        data     = request.get_json(force=True)
+        question = data.get("question","").strip()
+        if not question:
+            return jsonify(error="No question provided"), 400
 
-        # 7) Fallback URL + label
-        if not relevant_url and top.size:
-            relevant_url = metadata[top[0]].get("url")
-        link_label = URL_LABELS.get(relevant_url)
+        key = question.lower().rstrip("?")
+
+        # conversation context, if the widget sent a session id
+        sid = str(data.get("session_id") or "")
+        sid = sid if SESSION_ID_RE.match(sid) else None
+        summary, turns = session_store.history(sid) if sid else ("", [])
+        query, topic = standalone_query(question, turns)
 
-        return jsonify(answer=answer, url=relevant_url, link_label=link_label), 200
+        resp, status = route_question(question, key, query, summary, turns)
+
+        if sid and status == 200 and question != "__welcome__":
+            answer = resp.get_json()["answer"]
+            session_store.record_turn(sid, question, strip_boilerplate(answer), query, topic)
+        if query_log and question != "__welcome__":
+            body = resp.get_json() or {}
+            query_log.log(
+                ts=time.time(), turn=len(turns),
+                question=question[:TURN_CHARS], query=query[:TURN_CHARS],
+                branch=g.get("branch"), status=status, url=body.get("url"),
+                answer=(body.get("answer") or "")[:TURN_CHARS],
+                latency_ms=int(1000 * (time.monotonic() - started)),
+            )
+        return resp, status
 
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
 
+# ─── /metrics endpoint ────────────────────────────────────────────────────────
+@app.route("/metrics", methods=["GET"])
+def metrics_view():
+    with metrics_lock:
+        counters = dict(metrics)
+    return jsonify(
+        breakers={b.name: b.snapshot() for b in (emb_breaker, chat_breaker)},
+        rag_queue=rag_gate.snapshot(),
+        sessions=session_store.snapshot(),
+        answer_cache={"entries": len(answer_cache), "max": ANSWER_CACHE_SIZE},
+        query_log=query_log.snapshot() if query_log else None,
+        counters=counters
+    ), 200
+
 # ─── Run the app ─────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
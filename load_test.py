@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local load test for /ask: floods the RAG path and checks static answers stay fast.
+
+    python load_test.py --fake-upstream 3        # in-process app, OpenAI stubbed
+    python load_test.py --url http://127.0.0.1:5000 --rag-clients 20
+
+Admission limits are per process, so against a multi-worker gunicorn the
+RAG queue and rate limits scale with the worker count. Flood clients are
+told apart by X-Forwarded-For, which assumes TRUSTED_PROXY_HOPS=1.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+STATIC_QUESTION = "fees"
+RAG_QUESTION    = "Could you describe what a typical Tuesday afternoon looks like for pupils"
+
+
+# ─── In-process app with a stubbed (slow) OpenAI ─────────────────────────────
+def serve_with_fake_upstream(delay, port):
+    os.environ.setdefault("OPENAI_API_KEY", "load-test")
+    import app
+    from werkzeug.serving import make_server
+
+    def fake_embedding(model, input, timeout):
+        time.sleep(delay / 10)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=app.embeddings[0].tolist())])
+
+    def fake_chat(model, messages, timeout):
+        time.sleep(delay)
+        reply = SimpleNamespace(message=SimpleNamespace(content="This is a load-test answer."))
+        return SimpleNamespace(choices=[reply])
+
+    app.openai.embeddings = SimpleNamespace(create=fake_embedding)
+    app.openai.chat = SimpleNamespace(completions=SimpleNamespace(create=fake_chat))
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+# ─── Client ───────────────────────────────────────────────────────────────────
+def ask(base, question, client):
+    req = urllib.request.Request(
+        f"{base}/ask",
+        data=json.dumps({"question": question}).encode(),
+        headers={"Content-Type": "application/json", "X-Forwarded-For": client},
+    )
+    started, retry_after = time.monotonic(), 0
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status, retry_after = e.code, float(e.headers.get("Retry-After", 0))
+    return status, time.monotonic() - started, retry_after
+
+
+def percentiles(samples):
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+    return f"n={len(samples):4d}  p50={pick(0.50):7.1f}ms  p95={pick(0.95):7.1f}ms  p99={pick(0.99):7.1f}ms"
+
+
+def probe_static(base, seconds, interval):
+    latencies, statuses = [], Counter()
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        status, latency, _ = ask(base, STATIC_QUESTION, "static-probe")
+        statuses[status] += 1
+        latencies.append(latency)
+        time.sleep(interval)
+    return latencies, statuses
+
+
+def flood_rag(base, client, stop, results, lock):
+    n = 0
+    while not stop.is_set():
+        n += 1
+        # unique wording so neither cache can answer it
+        status, latency, retry_after = ask(base, f"{RAG_QUESTION} ({client} #{n})?", client)
+        with lock:
+            results[status].append(latency)
+        # back off like a well-behaved client when shed
+        stop.wait(retry_after)
+
+
+# ─── Main ─────────────────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--fake-upstream", type=float, metavar="SECONDS",
+                        help="serve app.py in-process with OpenAI stubbed to take SECONDS per chat call")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--rag-clients", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--baseline", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    base = serve_with_fake_upstream(args.fake_upstream, args.port) if args.fake_upstream else args.url
+
+    # 1) Static latency with no load
+    print(f"→ baseline: static only for {args.baseline:.0f}s")
+    base_lat, base_status = probe_static(base, args.baseline, args.interval)
+
+    # 2) Saturate RAG while probing static
+    print(f"→ load: {args.rag_clients} RAG clients for {args.duration:.0f}s")
+    stop, lock, results = threading.Event(), threading.Lock(), defaultdict(list)
+    threads = [
+        threading.Thread(target=flood_rag, args=(base, f"10.0.0.{i}", stop, results, lock), daemon=True)
+        for i in range(args.rag_clients)
+    ]
+    for t in threads:
+        t.start()
+    load_lat, load_status = probe_static(base, args.duration, args.interval)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    # 3) Report
+    print("\nstatic /ask (no load)   ", percentiles(base_lat), dict(base_status))
+    print("static /ask (RAG load)  ", percentiles(load_lat), dict(load_status))
+    for status in sorted(results):
+        print(f"RAG /ask → {status}        ", percentiles(results[status]))
+    with urllib.request.urlopen(f"{base}/metrics", timeout=10) as resp:
+        snapshot = json.load(resp)
+    print("\nrag_queue:", snapshot.get("rag_queue"))
+    print("shed:", {k: v for k, v in snapshot.get("counters", {}).items() if k.startswith("shed.")})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Offline analysis of the /ask query log (query_logs/queries-<pid>.jsonl*, one per worker).
+
+    python query_insights.py report [--top 20]   # top intents + the branch that served them
+    python query_insights.py warm   [--top 50]   # pre-compute answers → warm_cache.json
+
+app.py loads warm_cache.json on startup to seed its answer and embedding caches.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+EMB_MODEL    = "text-embedding-3-small"
+RAG_BRANCHES = {"rag", "extractive", "answer_cache"}
+
+
+# ─── Log loading ──────────────────────────────────────────────────────────────
+def load_entries(log_dir):
+    entries = []
+    for path in sorted(glob.glob(os.path.join(log_dir, "queries*.jsonl*"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue   # a torn last line from a crash
+    return entries
+
+
+def group_questions(entries):
+    """key → {"question": most common wording, "count": n, "branches": Counter}"""
+    groups = defaultdict(lambda: {"wordings": Counter(), "branches": Counter()})
+    for e in entries:
+        key = e["question"].lower().rstrip("?").strip()
+        groups[key]["wordings"][e["question"]] += 1
+        groups[key]["branches"][e.get("branch") or "unknown"] += 1
+    return {
+        key: {
+            "question": g["wordings"].most_common(1)[0][0],
+            "count":    sum(g["wordings"].values()),
+            "branches": g["branches"],
+        }
+        for key, g in groups.items()
+    }
+
+
+# ─── Clustering ───────────────────────────────────────────────────────────────
+def embed_all(texts, batch=100):
+    vectors = []
+    for i in range(0, len(texts), batch):
+        resp = openai.embeddings.create(model=EMB_MODEL, input=texts[i:i + batch])
+        vectors.extend(d.embedding for d in resp.data)
+        print(f"  → embedded {min(i + batch, len(texts))}/{len(texts)}")
+    vectors = np.array(vectors, dtype="float32")
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8)
+
+
+def cluster(groups, threshold):
+    # leader clustering, most frequent question first so it names the intent
+    keys    = sorted(groups, key=lambda k: -groups[k]["count"])
+    vectors = embed_all([groups[k]["question"] for k in keys])
+    clusters, centroids = [], []
+    for key, vec in zip(keys, vectors):
+        if centroids:
+            sims = np.array(centroids) @ vec
+            best = int(sims.argmax())
+            if sims[best] >= threshold:
+                clusters[best].append(key)
+                centroid = centroids[best] + vec
+                centroids[best] = centroid / np.linalg.norm(centroid)
+                continue
+        clusters.append([key])
+        centroids.append(vec)
+    return clusters
+
+
+def report(args):
+    entries = load_entries(args.log_dir)
+    if not entries:
+        print(f"No log entries in {args.log_dir}")
+        return
+    groups = group_questions(entries)
+    print(f"Loaded {len(entries)} queries, {len(groups)} distinct questions")
+
+    intents = []
+    for keys in cluster(groups, args.threshold):
+        branches = sum((groups[k]["branches"] for k in keys), Counter())
+        intents.append((sum(groups[k]["count"] for k in keys), keys, branches))
+    intents.sort(key=lambda i: -i[0])
+
+    print(f"\nTop {args.top} intents")
+    for rank, (n, keys, branches) in enumerate(intents[:args.top], start=1):
+        share = ", ".join(f"{b} {c / n:.0%}" for b, c in branches.most_common())
+        print(f"{rank:3d}. {n:5d}× {groups[keys[0]]['question']!r}  [{share}]")
+        for k in keys[1:4]:
+            print(f"            ~ {groups[k]['question']!r}")
+
+
+# ─── Cache warming ────────────────────────────────────────────────────────────
+def warm(args):
+    entries = [
+        e for e in load_entries(args.log_dir)
+        if e.get("branch") in RAG_BRANCHES and not e.get("turn")
+    ]
+    groups = group_questions(entries)
+    top = sorted(groups, key=lambda k: -groups[k]["count"])[:args.top]
+    if not top:
+        print(f"No first-turn RAG questions in {args.log_dir}")
+        return
+
+    # reuse the live pipeline so warmed answers match what /ask would say
+    import app
+
+    warmed = []
+    for idx, key in enumerate(top, start=1):
+        question = groups[key]["question"]
+        deadline = time.monotonic() + app.ANSWER_BUDGET
+        future, emb_deadline = app.start_embedding(key, question, deadline)
+        with app.app.app_context():
+            resp, status = app.rag_answer(
+                question, question, "", [], app.keyword_url(key), future, emb_deadline, deadline
+            )
+            body = resp.get_json()
+        vector = app.cached_query_vector(key)
+        if status != 200 or body.get("degraded") or vector is None:
+            print(f"  ✗ skipped {question!r} (upstream unavailable)")
+            continue
+        warmed.append({
+            "key":          key,
+            "question":     question,
+            "count":        groups[key]["count"],
+            "vector":       vector.tolist(),
+            "answer":       body["answer"],
+            "url":          body.get("url"),
+            "link_label":   body.get("link_label"),
+            # app.py ages warmed answers out from this, not from its own startup
+            "generated_at": time.time(),
+        })
+        print(f"  → warmed {idx}/{len(top)}: {question!r}")
+
+    # app.py may be starting while we write, so it must only ever see a complete file
+    tmp = f"{args.out}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(warmed, f, ensure_ascii=False)
+    os.replace(tmp, args.out)
+    print(f"Saved {len(warmed)} warmed answers to {args.out}")
+
+
+# ─── Main ─────────────────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-dir", default=os.getenv("QUERY_LOG_DIR") or "query_logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("report", help="cluster logged questions into intents")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--threshold", type=float, default=0.85, help="cosine similarity to join an intent")
+    p.set_defaults(func=report)
+
+    p = sub.add_parser("warm", help="pre-compute answers for the most frequent RAG questions")
+    p.add_argument("--top", type=int, default=50)
+    p.add_argument("--out", default=os.getenv("WARM_CACHE_PATH") or "warm_cache.json")
+    p.set_defaults(func=warm)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
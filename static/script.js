@@ -22,6 +22,15 @@ document.addEventListener("DOMContentLoaded", () => {
   let thinkingDiv       = null;
   let currentController = null;
 
+  // one server-side conversation per browser tab
+  let sessionId = sessionStorage.getItem("penai-session");
+  if (!sessionId) {
+    sessionId = (window.crypto && crypto.randomUUID)
+      ? crypto.randomUUID()
+      : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    sessionStorage.setItem("penai-session", sessionId);
+  }
+
   // ─── Quick-replies grouped by category ────────────────────────
   const quickByCat = {
     admissions: [
@@ -187,9 +196,17 @@ document.addEventListener("DOMContentLoaded", () => {
       const res = await fetch(ASK_URL, {
         method:  "POST",
         headers: { "Content-Type": "application/json" },
-        body:    JSON.stringify({ question }),
+        body:    JSON.stringify({ question, session_id: sessionId }),
         signal:  currentController.signal
       });
+      if (res.status === 429 || res.status === 503) {
+        // server is shedding load — ask the visitor to retry rather than erroring
+        removeThinking();
+        const wait = res.headers.get("Retry-After") || "a few";
+        renderBot(`I'm a little busy right now — please try again in ${wait} seconds.`,
+                  false, "admissions");
+        return;
+      }
       if (!res.ok) throw new Error(`HTTP ${res.status}`);
       const data = await res.json();
       removeThinking();